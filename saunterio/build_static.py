@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Build content-hashed, precompressed static assets.
+Run at deploy, from the repo root (Heroku runs it from bin/post_compile).
+
+Produces, under static/build/:
+    <name>.<hash>.<ext>, plus .gz and .br copies, for each stylesheet
+    about.html, plus .gz and .br copies, with stylesheet references rewritten to the hashed names
+    manifest.json, mapping each original file name to its hashed name
+And under views/build/, copies of the templates with stylesheet references rewritten.
+website.py serves from these when they exist, and falls back to static/ and views/ when they don't.
+"""
+
+import glob
+import gzip
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+
+import brotli
+
+assert (platform.python_version_tuple()[0:2] == ('3', '3'))
+
+STATIC_ROOT = 'static'
+STATIC_BUILD_ROOT = os.path.join(STATIC_ROOT, 'build')
+VIEWS_ROOT = 'views'
+VIEWS_BUILD_ROOT = os.path.join(VIEWS_ROOT, 'build')
+MANIFEST_PATH = os.path.join(STATIC_BUILD_ROOT, 'manifest.json')
+
+HASHED_ASSET_PATTERN = '*.css'
+HASH_LENGTH = 12
+
+
+def _write_precompressed(path, content):
+    """
+    Write `content` (bytes) to `path`, plus gzip and brotli copies alongside it.
+    """
+
+    with open(path, 'wb') as f:
+        f.write(content)
+
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(content, compresslevel=9))
+
+    with open(path + '.br', 'wb') as f:
+        f.write(brotli.compress(content))
+
+
+def _rewrite_references(text, manifest):
+    """
+    Point every /static/<name> reference that has a hashed build at the hashed name instead.
+    """
+
+    def hashed(match):
+        name = match.group(1)
+        return '/static/' + manifest[name] if name in manifest else match.group(0)
+
+    return re.sub(r'/static/([\w.-]+)', hashed, text)
+
+
+def build():
+    shutil.rmtree(STATIC_BUILD_ROOT, ignore_errors=True)
+    shutil.rmtree(VIEWS_BUILD_ROOT, ignore_errors=True)
+    os.makedirs(STATIC_BUILD_ROOT)
+    os.makedirs(VIEWS_BUILD_ROOT)
+
+    manifest = {}
+
+    for path in sorted(glob.glob(os.path.join(STATIC_ROOT, HASHED_ASSET_PATTERN))):
+        with open(path, 'rb') as f:
+            content = f.read()
+
+        name = os.path.basename(path)
+        stem, ext = os.path.splitext(name)
+        hashed_name = "{}.{}{}".format(stem, hashlib.sha256(content).hexdigest()[:HASH_LENGTH], ext)
+
+        _write_precompressed(os.path.join(STATIC_BUILD_ROOT, hashed_name), content)
+        manifest[name] = hashed_name
+
+    # about.html keeps its own name (its URL is /about), so it's precompressed but not hashed
+    with open(os.path.join(STATIC_ROOT, 'about.html'), encoding='utf-8') as f:
+        about = _rewrite_references(f.read(), manifest)
+    _write_precompressed(os.path.join(STATIC_BUILD_ROOT, 'about.html'), about.encode('utf-8'))
+
+    for path in glob.glob(os.path.join(VIEWS_ROOT, '*.tpl')):
+        with open(path, encoding='utf-8') as f:
+            view = _rewrite_references(f.read(), manifest)
+        with open(os.path.join(VIEWS_BUILD_ROOT, os.path.basename(path)), 'w', encoding='utf-8') as f:
+            f.write(view)
+
+    with open(MANIFEST_PATH, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    print("Built {} hashed assets".format(len(manifest)))
+
+
+if __name__ == '__main__':
+    build()
@@ -3,12 +3,14 @@
 
 import os
 import platform
+import traceback
 
 from pymongo import MongoClient, DESCENDING
 
 import etl
 import notify_email
 import score
+import stats
 
 assert (platform.python_version_tuple()[0:2] == ('3', '3'))
 
@@ -36,3 +38,14 @@ most_recent_scoring = db.scorings.find_one(sort=[("report_datetime_native", DESC
 if most_recent_scoring['beat_threshold']:
     notify_email.send_alerts(score=100.0 - most_recent_scoring['qualifying_score'],
                              threshold=100.0 - most_recent_scoring['historical_threshold'])
+
+# 4. Update cached history statistics
+
+# Recalculating scores only changes old dates when the algorithm or thresholds change. refresh_stats() notices
+# threshold changes itself; after an algorithm change, run `python saunterio/stats.py --full`.
+# This runs after alerts so a stats failure can never hold them up; log it rather than fail the job.
+try:
+    stats.refresh_stats()
+except Exception:
+    print("Refreshing stats failed")
+    traceback.print_exc()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Export scorings to a columnar, memory-mappable dataset for offline analysis.
+Run from the repo root; each run appends the scored dates not yet exported as new partitions, and once there
+are more than MAX_PARTITIONS, compacts them back into one:
+
+    python saunterio/export.py export/
+
+Layout of the export directory:
+    metadata.json                   Partitions, ineligibility code table, last exported date
+    part-<first>_<last>/scorings/   One .npy file per column, one row per scored date
+    part-<first>_<last>/hourly/     One .npy file per column, one row per entry of hourly_scores_diagnostic
+
+Load with `load('export/')` (or `load('export/', 'hourly')`) in a notebook; that needs only numpy, not MongoDB.
+Exporting needs numpy too, which the web app doesn't.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+
+import numpy as np
+from pymongo import MongoClient, ASCENDING
+
+assert (platform.python_version_tuple()[0:2] == ('3', '3'))
+
+FORMAT_VERSION = 1
+
+# Scorings are converted and written this many at a time, so exporting never holds all of history in memory
+CHUNK_SCORINGS = 1000
+
+# Nightly appends add a small partition each; merge them only once there are this many, so an append
+# doesn't cost a rewrite of all history every time
+MAX_PARTITIONS = 32
+
+# Scorings don't record a station yet; everything so far is Raleigh WBAN 13722 (RDU)
+DEFAULT_WBAN = 13722
+
+# Code 0 means "not ineligible". Known reasons from thresholds.py come first, so their codes are stable;
+# reasons not listed here are added to an export's code table as they're first seen.
+INELIGIBLE_CODES = {
+    '': 0,
+    'Ineligible-NoDayNight': 1,
+    'Ineligible-InsufficientDaylightObs': 2,
+    'Ineligible-InsufficientHourlyObs': 3,
+    'Ineligible-NoScoredThreeHours': 4,
+    'Ineligible-Precipitation': 5,
+    'Ineligible-Cloudy': 6,
+    'Ineligible-WindSpeed': 7,
+    'Ineligible-SunNotRisen': 8,
+    'Ineligible-SunHasSet': 9,
+}
+
+# Leave out the pickled *_datetime_arrow blobs; report_datetime_native and scored_date_iso carry the same dates
+SCORING_PROJECTION = ['wban', 'scored_date_iso', 'report_datetime_native', 'eligible', 'beat_threshold',
+                      'historical_threshold', 'qualifying_score', 'qualifying_runs', 'ineligible_reason',
+                      'hourly_scores_diagnostic']
+
+
+def _empty_metadata():
+    return {'format_version': FORMAT_VERSION,
+            'ineligible_codes': dict(INELIGIBLE_CODES),
+            'partitions': [],
+            'exported_through_iso': None}
+
+
+def _read_metadata(path):
+    try:
+        with open(os.path.join(path, 'metadata.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return _empty_metadata()
+
+
+def _write_metadata(path, metadata):
+    # Write then rename, so a failed run never leaves metadata pointing at a half-written partition
+    temp_path = os.path.join(path, 'metadata.json.tmp')
+    with open(temp_path, 'w') as f:
+        json.dump(metadata, f, indent=2, sort_keys=True)
+    os.replace(temp_path, os.path.join(path, 'metadata.json'))
+
+
+def _database():
+    # Only exporting talks to MongoDB; loading an export shouldn't need database settings
+    if 'MONGOLAB_URI' in os.environ:  # prod
+        client = MongoClient(os.environ.get('MONGOLAB_URI'))
+    else:  # dev
+        client = MongoClient(os.environ.get('MONGODB_URI'))
+
+    return client.get_default_database()
+
+
+def _latest_scorings(db, since_date_iso):
+    """
+    Stream scorings after `since_date_iso`, one per scored date (the most recent report, as on the homepage).
+    :param db: The MongoDB database holding `scorings`.
+    :param since_date_iso: Last scored date (YYYY-MM-DD) already exported, or None for all history.
+    """
+
+    query = {} if since_date_iso is None else {'scored_date_iso': {'$gt': since_date_iso}}
+    cursor = db.scorings.find(query, projection=SCORING_PROJECTION, batch_size=1000)
+    cursor.sort([('scored_date_iso', ASCENDING), ('report_datetime_native', ASCENDING)])
+
+    previous = None
+    for scoring in cursor:
+        if previous is not None and scoring['scored_date_iso'] != previous['scored_date_iso']:
+            yield previous
+        previous = scoring
+    if previous is not None:
+        yield previous
+
+
+def _code(reason, codes):
+    if reason not in codes:
+        codes[reason] = max(codes.values()) + 1
+    return codes[reason]
+
+
+def _columns(scorings, codes):
+    """
+    Convert scoring documents to typed columns.
+    :param codes: The export's ineligibility code table; extended in place with any new reasons.
+    :return: A tuple of (scorings columns, hourly columns), each a dict of column name to numpy array.
+    """
+
+    s = dict((name, []) for name in ['wban', 'scored_date', 'report_datetime', 'eligible', 'beat_threshold',
+                                     'historical_threshold', 'qualifying_score', 'ineligible_code',
+                                     'qualifying_runs', 'first_run_start', 'first_run_end'])
+    h = dict((name, []) for name in ['wban', 'scored_date', 'position', 'score', 'ineligible_code'])
+
+    for scoring in scorings:
+        runs = scoring.get('qualifying_runs', [])
+
+        s['wban'].append(scoring.get('wban', DEFAULT_WBAN))
+        s['scored_date'].append(scoring['scored_date_iso'])
+        s['report_datetime'].append(scoring['report_datetime_native'])
+        s['eligible'].append(scoring['eligible'])
+        s['beat_threshold'].append(scoring['beat_threshold'])
+        s['historical_threshold'].append(scoring['historical_threshold'])
+        s['qualifying_score'].append(scoring.get('qualifying_score', np.nan))
+        s['ineligible_code'].append(_code(scoring.get('ineligible_reason', ''), codes))
+        s['qualifying_runs'].append(len(runs))
+        # Minutes past local midnight, or -1 when there's no qualifying run
+        s['first_run_start'].append(runs[0]['start'] if runs else -1)
+        s['first_run_end'].append(runs[0]['end'] if runs else -1)
+
+        # Positions follow the forecast's hourly observations, which skip hours with missing fields
+        for position, hourly_score in enumerate(scoring.get('hourly_scores_diagnostic', [])):
+            eligible_hour = isinstance(hourly_score, float)
+            h['wban'].append(scoring.get('wban', DEFAULT_WBAN))
+            h['scored_date'].append(scoring['scored_date_iso'])
+            h['position'].append(position)
+            h['score'].append(hourly_score if eligible_hour else np.nan)
+            h['ineligible_code'].append(0 if eligible_hour else _code(hourly_score, codes))
+
+    scorings_columns = {
+        'wban': np.array(s['wban'], dtype=np.int32),
+        'scored_date': np.array(s['scored_date'], dtype='datetime64[D]'),
+        'report_datetime': np.array(s['report_datetime'], dtype='datetime64[s]'),
+        'eligible': np.array(s['eligible'], dtype=np.bool_),
+        'beat_threshold': np.array(s['beat_threshold'], dtype=np.bool_),
+        'historical_threshold': np.array(s['historical_threshold'], dtype=np.float32),
+        'qualifying_score': np.array(s['qualifying_score'], dtype=np.float32),
+        'ineligible_code': np.array(s['ineligible_code'], dtype=np.int8),
+        'qualifying_runs': np.array(s['qualifying_runs'], dtype=np.int8),
+        'first_run_start': np.array(s['first_run_start'], dtype=np.int16),
+        'first_run_end': np.array(s['first_run_end'], dtype=np.int16),
+    }
+
+    hourly_columns = {
+        'wban': np.array(h['wban'], dtype=np.int32),
+        'scored_date': np.array(h['scored_date'], dtype='datetime64[D]'),
+        'position': np.array(h['position'], dtype=np.int8),
+        'score': np.array(h['score'], dtype=np.float32),
+        'ineligible_code': np.array(h['ineligible_code'], dtype=np.int8),
+    }
+
+    return scorings_columns, hourly_columns
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _partition_name(first_date_iso, last_date_iso):
+    return 'part-{}_{}'.format(first_date_iso, last_date_iso)
+
+
+def _open_table(path, partition, table):
+    table_path = os.path.join(path, partition['name'], table)
+    return dict((name[:-len('.npy')], np.load(os.path.join(table_path, name), mmap_mode='r'))
+                for name in os.listdir(table_path))
+
+
+def _write_partition(path, metadata, scorings):
+    """
+    Write one chunk of scorings as a new partition, and record it in the metadata.
+    """
+
+    scorings_columns, hourly_columns = _columns(scorings, metadata['ineligible_codes'])
+
+    first, last = scorings[0]['scored_date_iso'], scorings[-1]['scored_date_iso']
+    partition = _partition_name(first, last)
+
+    for table, columns in [('scorings', scorings_columns), ('hourly', hourly_columns)]:
+        table_path = os.path.join(path, partition, table)
+        os.makedirs(table_path, exist_ok=True)
+        for name, column in columns.items():
+            np.save(os.path.join(table_path, name + '.npy'), column)
+
+    metadata['partitions'].append({'name': partition,
+                                   'first_date_iso': first,
+                                   'last_date_iso': last,
+                                   'scorings_rows': len(scorings_columns['scored_date']),
+                                   'hourly_rows': len(hourly_columns['scored_date'])})
+    metadata['exported_through_iso'] = last
+    _write_metadata(path, metadata)
+
+
+def _compact(path, metadata):
+    """
+    Merge all partitions into one, copying column by column through memory maps to keep memory use flat.
+    """
+
+    old_partitions = metadata['partitions']
+
+    merged = {'name': _partition_name(old_partitions[0]['first_date_iso'], old_partitions[-1]['last_date_iso']),
+              'first_date_iso': old_partitions[0]['first_date_iso'],
+              'last_date_iso': old_partitions[-1]['last_date_iso'],
+              'scorings_rows': sum(p['scorings_rows'] for p in old_partitions),
+              'hourly_rows': sum(p['hourly_rows'] for p in old_partitions)}
+
+    for table in ['scorings', 'hourly']:
+        table_path = os.path.join(path, merged['name'], table)
+        os.makedirs(table_path, exist_ok=True)
+
+        sources = [_open_table(path, p, table) for p in old_partitions]
+        for name in sources[0]:
+            target = np.lib.format.open_memmap(os.path.join(table_path, name + '.npy'), mode='w+',
+                                               dtype=sources[0][name].dtype,
+                                               shape=(merged[table + '_rows'],))
+            offset = 0
+            for source in sources:
+                target[offset:offset + len(source[name])] = source[name]
+                offset += len(source[name])
+            target.flush()
+            del target
+
+        del sources  # Release the memory maps before the old files are removed
+
+    metadata['partitions'] = [merged]
+    _write_metadata(path, metadata)
+
+    for p in old_partitions:
+        shutil.rmtree(os.path.join(path, p['name']), ignore_errors=True)
+
+
+def export(path, full=False):
+    """
+    Append scored dates not yet in the export at `path`, compacting it once it has too many partitions.
+    Dates already exported are left alone, even if scorings were since recalculated; use `full` to rebuild.
+    :param path: Export directory; created if missing.
+    :param full: Discard existing partitions and export all history.
+    """
+
+    os.makedirs(path, exist_ok=True)
+
+    metadata = _read_metadata(path)
+    if full:
+        # Forget the old partitions before deleting them, so metadata never points at missing files
+        old_partitions = metadata['partitions']
+        metadata = _empty_metadata()
+        _write_metadata(path, metadata)
+        for p in old_partitions:
+            shutil.rmtree(os.path.join(path, p['name']), ignore_errors=True)
+
+    since = metadata['exported_through_iso']
+    exported = 0
+    for chunk in _chunks(_latest_scorings(_database(), since), CHUNK_SCORINGS):
+        _write_partition(path, metadata, chunk)
+        exported += len(chunk)
+
+    if not exported:
+        print("Nothing new to export")
+        return
+
+    if len(metadata['partitions']) > MAX_PARTITIONS:
+        _compact(path, metadata)
+
+    print("Exported {} scorings (through {}) to {}".format(exported, metadata['exported_through_iso'], path))
+
+
+def load(path, table='scorings'):
+    """
+    Load an exported table as a dict of column name to memory-mapped numpy array.
+    With a single partition, columns map straight from disk. With several (at most MAX_PARTITIONS, between
+    compactions) they're concatenated, which copies them into memory; history is small enough for that to be quick.
+    :param path: Export directory.
+    :param table: 'scorings' or 'hourly'.
+    """
+
+    partitions = [_open_table(path, p, table) for p in _read_metadata(path)['partitions']]
+
+    if not partitions:
+        return {}
+    if len(partitions) == 1:
+        return partitions[0]
+    return dict((name, np.concatenate([p[name] for p in partitions])) for name in partitions[0])
+
+
+def ineligible_reasons(path):
+    """
+    :return: The export's ineligibility code table, as a dict of code to reason.
+    """
+
+    return dict((code, reason) for (reason, code) in _read_metadata(path)['ineligible_codes'].items())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export scorings to a columnar dataset.")
+    parser.add_argument('path', nargs='?', default='export', help="export directory")
+    parser.add_argument('--full', action='store_true', help="discard existing partitions and export all history")
+    args = parser.parse_args()
+
+    export(args.path, full=args.full)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Load test the web tier against a local MongoDB seeded with synthetic scorings.
+Run from the repo root, with a local mongod running:
+
+    python saunterio/loadtest.py --days 1500 --concurrency 20 --requests 5000 --output loadtest.json
+
+Seeds the database at LOADTEST_MONGODB_URI (never MONGOLAB_URI), starts website.py against it,
+drives the routes concurrently, and saves latency percentiles, throughput and error rates as JSON.
+"""
+
+import argparse
+import calendar
+import csv
+import datetime
+import json
+import math
+import os
+import pickle
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import arrow as arrow_dt
+import requests
+from bson.objectid import ObjectId
+from pymongo import MongoClient
+
+assert (platform.python_version_tuple()[0:2] == ('3', '3'))
+
+DEFAULT_MONGODB_URI = 'mongodb://localhost:27017/saunterio_loadtest'
+DEFAULT_ROUTES = ['/', '/about', '/static/style.css', '/static/normalize.css', '/static/skeleton.css']
+TIMEZONE = 'America/New_York'
+
+
+def _load_thresholds():
+    historical_thresholds = {}
+    with open('data/raleigh_thresholds.csv') as csv_file:
+        for row in csv.reader(csv_file):
+            historical_thresholds[int(row[0])] = float(row[1])
+    return historical_thresholds
+
+
+def _synthetic_scoring(scored_date, historical_thresholds, rng):
+    """
+    Build one scoring document shaped like those written by score.recalculate_all_scores().
+    :param scored_date: The arrow date being scored (local to TIMEZONE).
+    :param historical_thresholds: Thresholds by leap-year-free day ordinal, as in score.py.
+    :param rng: A random.Random instance.
+    """
+
+    day_ordinal = int(scored_date.strftime("%j"))
+    if calendar.isleap(scored_date.year) and day_ordinal >= 60:
+        day_ordinal -= 1
+
+    report_time = scored_date.replace(days=-1, hour=20, minute=30)
+
+    # Hourly scores follow the shape of process_day(): a float per eligible hour, a reason string otherwise
+    hourly_scores = []
+    for hour in range(24):
+        if hour < 6 or hour > 20:
+            hourly_scores.append(rng.choice(['Ineligible-SunNotRisen', 'Ineligible-SunHasSet']))
+        elif rng.random() < 0.25:
+            hourly_scores.append(rng.choice(['Ineligible-Precipitation', 'Ineligible-Cloudy', 'Ineligible-WindSpeed']))
+        else:
+            hourly_scores.append(round(abs(rng.gauss(18, 8)), 1))
+
+    scoring = {
+        'scored_date_iso': scored_date.format('YYYY-MM-DD'),
+        'origin_forecast_id': ObjectId(),
+        'scored_date_friendly': scored_date.format('MMMM D, YYYY'),
+        'generated_datetime_arrow': pickle.dumps(report_time.replace(minutes=+5)),
+        'report_datetime_arrow': pickle.dumps(report_time),
+        'report_datetime_native': datetime.datetime.utcfromtimestamp(report_time.timestamp),
+        'eligible': rng.random() < 0.7,
+        'historical_threshold': historical_thresholds[day_ordinal],
+        'hourly_scores_diagnostic': hourly_scores,
+    }
+
+    if scoring['eligible']:
+        start = rng.randrange(6, 15) * 60
+        worst_score = round(abs(rng.gauss(20, 7)), 1)
+        scoring['qualifying_runs'] = [{'start': start, 'end': start + rng.randrange(3, 7) * 60,
+                                       'qualifying_score': worst_score}]
+        scoring['qualifying_score'] = worst_score
+    else:
+        scoring['ineligible_reason'] = rng.choice(['Ineligible-NoScoredThreeHours',
+                                                   'Ineligible-InsufficientDaylightObs'])
+
+    scoring['beat_threshold'] = scoring['eligible'] and scoring['qualifying_score'] < scoring['historical_threshold']
+
+    return scoring
+
+
+def seed(db, days, rng):
+    """
+    Replace the scorings collection with `days` days of synthetic history, ending tomorrow.
+    """
+
+    historical_thresholds = _load_thresholds()
+    tomorrow = arrow_dt.now(TIMEZONE).floor('day').replace(days=+1)
+
+    db.scorings.drop()
+
+    batch = []
+    for offset in range(days):
+        batch.append(_synthetic_scoring(tomorrow.replace(days=-offset), historical_thresholds, rng))
+        if len(batch) == 1000:
+            db.scorings.insert_many(batch)
+            batch = []
+    if batch:
+        db.scorings.insert_many(batch)
+
+    print("Seeded {} scorings".format(days))
+
+
+def _resolve_static_routes(base_url, routes):
+    """
+    Swap static routes for the names the server actually links to, so caching changes are exercised.
+    When the server serves a static build, its pages link to hashed names (e.g. style.<hash>.css) instead.
+    """
+
+    served = {}
+    for page in ['/', '/about']:
+        try:
+            html = requests.get(base_url + page, timeout=30).text
+        except requests.RequestException:
+            continue
+        for href in re.findall(r'href="(/static/[^"]+)"', html):
+            # Map the hashed name back to the original, e.g. style.0123456789ab.css -> style.css
+            served[re.sub(r'\.[0-9a-f]{12}(\.\w+)$', r'\1', href)] = href
+
+    return [served.get(route, route) for route in routes]
+
+
+def _start_server(port, mongodb_uri):
+    env = dict(os.environ, PORT=str(port), MONGODB_URI=mongodb_uri)
+    env.pop('MONGOLAB_URI', None)  # website.py prefers MONGOLAB_URI; make sure it can't reach prod
+
+    server = subprocess.Popen([sys.executable, 'saunterio/website.py'], env=env)
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("website.py exited with status {}".format(server.returncode))
+        try:
+            socket.create_connection(('localhost', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+
+    server.terminate()
+    raise RuntimeError("website.py did not start listening on port {}".format(port))
+
+
+def _percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def _summarize(samples, duration):
+    """
+    :param samples: List of (latency in seconds, error flag) tuples.
+    :param duration: Wall-clock seconds the samples were collected over.
+    """
+
+    latencies_ms = sorted(latency * 1000 for (latency, error) in samples)
+    errors = sum(1 for (latency, error) in samples if error)
+
+    return {'requests': len(samples),
+            'errors': errors,
+            'error_rate': errors / len(samples) if samples else None,
+            'throughput_rps': len(samples) / duration if duration else None,
+            'mean_ms': sum(latencies_ms) / len(latencies_ms) if latencies_ms else None,
+            'p50_ms': _percentile(latencies_ms, 50),
+            'p95_ms': _percentile(latencies_ms, 95),
+            'p99_ms': _percentile(latencies_ms, 99),
+            'max_ms': latencies_ms[-1] if latencies_ms else None}
+
+
+def drive(base_url, routes, total_requests, concurrency):
+    """
+    Send `total_requests` requests, cycling through `routes`, from `concurrency` threads.
+    :return: A dict of results, overall and by route.
+    """
+
+    sessions = threading.local()  # requests.Session isn't thread safe; give each worker its own
+
+    def fetch(route):
+        if not hasattr(sessions, 'session'):
+            sessions.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = sessions.session.get(base_url + route, timeout=30)
+            response.content  # Include body transfer in the timing
+            error = response.status_code >= 400
+        except requests.RequestException:
+            error = True
+        return route, time.perf_counter() - start, error
+
+    planned = [routes[i % len(routes)] for i in range(total_requests)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(fetch, planned))
+    duration = time.perf_counter() - start
+
+    by_route = {}
+    for route, latency, error in results:
+        by_route.setdefault(route, []).append((latency, error))
+
+    overall = _summarize([(latency, error) for (route, latency, error) in results], duration)
+    overall['duration_s'] = duration
+
+    return {'overall': overall,
+            'routes': dict((route, _summarize(samples, duration)) for (route, samples) in by_route.items())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the saunter.io web tier.")
+    parser.add_argument('--days', type=int, default=1000, help="days of scorings history to seed")
+    parser.add_argument('--no-seed', action='store_true', help="reuse the existing loadtest database")
+    parser.add_argument('--seed', action='store_true',
+                        help="seed the loadtest database even with --url (only useful if that server reads it)")
+    parser.add_argument('--concurrency', type=int, default=10, help="concurrent client threads")
+    parser.add_argument('--requests', type=int, default=2000, help="total requests to send")
+    parser.add_argument('--routes', nargs='+', default=DEFAULT_ROUTES, help="routes to cycle through")
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--url', help="drive an already running server instead of starting website.py")
+    parser.add_argument('--random-seed', type=int, default=13722)
+    parser.add_argument('--output', default='loadtest.json', help="where to save results as JSON")
+    args = parser.parse_args()
+
+    mongodb_uri = os.environ.get('LOADTEST_MONGODB_URI', DEFAULT_MONGODB_URI)
+
+    # A server given by --url has its own database; seeding ours would only wipe it and misreport the data size
+    seeding = args.seed or not (args.no_seed or args.url)
+
+    if seeding:
+        seed(MongoClient(mongodb_uri).get_default_database(), args.days, random.Random(args.random_seed))
+
+    server = None if args.url else _start_server(args.port, mongodb_uri)
+    try:
+        base_url = args.url or 'http://localhost:{}'.format(args.port)
+        routes = _resolve_static_routes(base_url, args.routes)  # Also warms the server up before measuring
+        started = arrow_dt.utcnow()
+        results = drive(base_url, routes, args.requests, args.concurrency)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    results['config'] = {'days': args.days if seeding else None,  # None when the data size is unknown
+                         'concurrency': args.concurrency,
+                         'requests': args.requests,
+                         'routes': routes,
+                         'base_url': base_url,
+                         'started_datetime_iso': started.isoformat()}
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    overall = results['overall']
+    if overall['requests'] and overall['throughput_rps'] is not None:
+        print("{requests} requests, {errors} errors, {throughput_rps:.1f} req/s, "
+              "p50 {p50_ms:.1f} ms, p95 {p95_ms:.1f} ms, p99 {p99_ms:.1f} ms".format(**overall))
+    else:
+        print("No requests completed")
+    print("Saved results to {}".format(args.output))
+
+
+if __name__ == '__main__':
+    main()
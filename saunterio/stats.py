@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Summarize scoring history with MongoDB aggregation pipelines.
+Results are cached in the `stats` collection; refresh nightly, after scoring.
+Run `python saunterio/stats.py --full` from the repo root to rebuild the cache by hand.
+"""
+
+import argparse
+import datetime
+import hashlib
+import os
+import platform
+import time
+
+import arrow as arrow_dt
+from pymongo import MongoClient, ReadPreference, ASCENDING, DESCENDING
+
+assert (platform.python_version_tuple()[0:2] == ('3', '3'))
+
+if 'MONGOLAB_URI' in os.environ:  # prod
+    client = MongoClient(os.environ.get('MONGOLAB_URI'))
+else:  # dev
+    client = MongoClient(os.environ.get('MONGODB_URI'))
+
+db = client.get_default_database()
+
+# Analytics reads go to a secondary when the deployment has one, so they stay off the primary that serves
+# the homepage. Without a replica set this silently falls back to the primary.
+analytics_scorings = db.get_collection('scorings', read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+# How long to wait for a secondary to catch up with the nightly rescoring before reading from the primary instead
+REPLICATION_WAIT_SECONDS = 120
+
+# Abort a runaway pipeline rather than let it hog the database
+AGGREGATE_MAX_TIME_MS = 60 * 1000
+
+
+def _latest_scoring_per_date(match):
+    """
+    Pipeline stages that reduce `scorings` to one document per scored date.
+    Back-fills and re-runs can leave several scorings for a date; like the homepage, keep the most recent report.
+    :param match: MongoDB query restricting which scorings are considered.
+    """
+
+    return [
+        {'$match': match},
+        {'$sort': {'report_datetime_native': ASCENDING}},
+        {'$group': {'_id': '$scored_date_iso',
+                    'eligible': {'$last': '$eligible'},
+                    'beat_threshold': {'$last': '$beat_threshold'},
+                    'qualifying_score': {'$last': '$qualifying_score'},
+                    'historical_threshold': {'$last': '$historical_threshold'}}},
+    ]
+
+
+def _aggregate(scorings, pipeline):
+    return scorings.aggregate(pipeline, allowDiskUse=True, maxTimeMS=AGGREGATE_MAX_TIME_MS)
+
+
+def _caught_up_scorings():
+    """
+    Pick the collection to refresh from. The nightly job rebuilds `scorings` just before refreshing, and a lagging
+    secondary would hand back a half-rebuilt collection, so wait until it matches the primary's newest scored date
+    and document count. If it doesn't catch up in time, read from the primary.
+    """
+
+    def newest_and_count(scorings):
+        newest = scorings.find_one(sort=[('scored_date_iso', DESCENDING)], projection=['scored_date_iso'])
+        return (newest['scored_date_iso'] if newest else None), scorings.count()
+
+    primary = newest_and_count(db.scorings)
+    deadline = time.time() + REPLICATION_WAIT_SECONDS
+    while time.time() < deadline:
+        if newest_and_count(analytics_scorings) == primary:
+            return analytics_scorings
+        time.sleep(5)
+
+    print("Secondary hasn't caught up with scorings; refreshing stats from the primary")
+    return db.scorings
+
+
+def _refresh_months(scorings, since_date_iso):
+    """
+    Recalculate beats per month for every month from `since_date_iso` onward.
+    :param scorings: The `scorings` collection to read, with the read preference to use.
+    :param since_date_iso: First scored date (YYYY-MM-DD) to include, or None for all history.
+    :return: The ids of the stats documents written.
+    """
+
+    match = {} if since_date_iso is None else {'scored_date_iso': {'$gte': since_date_iso}}
+
+    pipeline = _latest_scoring_per_date(match) + [
+        {'$group': {'_id': {'$substr': ['$_id', 0, 7]},  # YYYY-MM
+                    'days': {'$sum': 1},
+                    'eligible_days': {'$sum': {'$cond': ['$eligible', 1, 0]}},
+                    'beats': {'$sum': {'$cond': ['$beat_threshold', 1, 0]}}}},
+    ]
+
+    written = []
+    for month in _aggregate(scorings, pipeline):
+        written.append('month:' + month['_id'])
+        db.stats.replace_one({'_id': 'month:' + month['_id']},
+                             {'kind': 'month',
+                              'month': month['_id'],
+                              'days': month['days'],
+                              'eligible_days': month['eligible_days'],
+                              'beats': month['beats']},
+                             upsert=True)
+    return written
+
+
+def _refresh_days_of_year(scorings, month_days, years):
+    """
+    Recalculate the score distribution against `historical_threshold` for the given days of year.
+    Each day of year pools that calendar day across all years, so a new scoring means recalculating its whole bucket.
+    :param scorings: The `scorings` collection to read, with the read preference to use.
+    :param month_days: Days of year to recalculate, as 'MM-DD' strings, or None for all of them.
+    :param years: Years of history to pool, as integers. Only used when `month_days` is given.
+    :return: The ids of the stats documents written.
+    """
+
+    if month_days is None:
+        match = {}
+    else:
+        # Spell out every matching date, so the query can use the scored_date_iso index
+        match = {'scored_date_iso': {'$in': ["{}-{}".format(y, md) for y in years for md in month_days]}}
+
+    pipeline = _latest_scoring_per_date(match) + [
+        {'$group': {'_id': {'$substr': ['$_id', 5, 5]},  # MM-DD
+                    'days': {'$sum': 1},
+                    'eligible_days': {'$sum': {'$cond': ['$eligible', 1, 0]}},
+                    'beats': {'$sum': {'$cond': ['$beat_threshold', 1, 0]}},
+                    'mean_threshold': {'$avg': '$historical_threshold'},
+                    # Ineligible days have no qualifying_score; $avg, $min and $max skip them
+                    'mean_score': {'$avg': '$qualifying_score'},
+                    'best_score': {'$min': '$qualifying_score'},
+                    'worst_score': {'$max': '$qualifying_score'},
+                    # Positive margin means the score beat the threshold (lower scores are better)
+                    'mean_margin': {'$avg': {'$subtract': ['$historical_threshold', '$qualifying_score']}}}},
+    ]
+
+    written = []
+    for day in _aggregate(scorings, pipeline):
+        month_day = day.pop('_id')
+        day.update({'kind': 'day_of_year', 'month_day': month_day})
+        written.append('day_of_year:' + month_day)
+        db.stats.replace_one({'_id': 'day_of_year:' + month_day}, day, upsert=True)
+    return written
+
+
+def _thresholds_digest():
+    # Thresholds feed every beat_threshold, so a change to them rewrites old dates
+    with open('data/raleigh_thresholds.csv', 'rb') as csv_file:
+        return hashlib.sha256(csv_file.read()).hexdigest()
+
+
+def _last_beaten_date_iso(scorings):
+    # Same per-date deduplication as the other pipelines, so "days since" agrees with the month totals
+    pipeline = _latest_scoring_per_date({}) + [
+        {'$match': {'beat_threshold': True}},
+        {'$sort': {'_id': DESCENDING}},
+        {'$limit': 1},
+    ]
+
+    for day in _aggregate(scorings, pipeline):
+        return day['_id']
+    return None
+
+
+def refresh_stats(full=False):
+    """
+    Bring the cached statistics in the `stats` collection up to date with `scorings`.
+    By default only months and days of year touched since the previous refresh are recalculated,
+    unless the thresholds have changed since then.
+    :param full: Recalculate everything. Use after the scoring algorithm changes historical scores.
+    """
+
+    db.scorings.create_index('scored_date_iso')
+
+    scorings = _caught_up_scorings()
+
+    first_scoring = scorings.find_one(sort=[('scored_date_iso', ASCENDING)])
+    latest_scoring = scorings.find_one(sort=[('scored_date_iso', DESCENDING)])
+    if latest_scoring is None:
+        return
+
+    summary = db.stats.find_one({'_id': 'summary'})
+    thresholds_digest = _thresholds_digest()
+
+    if full or summary is None or summary.get('thresholds_digest') != thresholds_digest:
+        # Overwrite in place, then drop whatever wasn't rewritten, so the stats page never shows empty tables
+        written = _refresh_months(scorings, None) + _refresh_days_of_year(scorings, None, None)
+        db.stats.delete_many({'kind': {'$in': ['month', 'day_of_year']}, '_id': {'$nin': written}})
+    else:
+        # Start from the beginning of the last refreshed month, since that month may have been incomplete
+        since = arrow_dt.get(summary['refreshed_through_iso']).floor('month')
+        _refresh_months(scorings, since.format('YYYY-MM-DD'))
+
+        month_days = set()
+        for day in arrow_dt.Arrow.range('day', since, arrow_dt.get(latest_scoring['scored_date_iso'])):
+            month_days.add(day.format('MM-DD'))
+        years = range(int(first_scoring['scored_date_iso'][0:4]), int(latest_scoring['scored_date_iso'][0:4]) + 1)
+        _refresh_days_of_year(scorings, sorted(month_days), years)
+
+    db.stats.replace_one({'_id': 'summary'},
+                         {'kind': 'summary',
+                          'refreshed_through_iso': latest_scoring['scored_date_iso'],
+                          'first_scored_date_iso': first_scoring['scored_date_iso'],
+                          'last_beaten_date_iso': _last_beaten_date_iso(scorings),
+                          'thresholds_digest': thresholds_digest,
+                          'refreshed_datetime_native': datetime.datetime.utcnow()},
+                         upsert=True)
+
+
+def load_stats():
+    """
+    Read cached statistics for display. Only touches the small `stats` collection, never `scorings`.
+    :return: A dict with the summary, per-month and per-day-of-year statistics, or None if never refreshed.
+    """
+
+    summary = db.stats.find_one({'_id': 'summary'})
+    if summary is None:
+        return None
+
+    months = list(db.stats.find({'kind': 'month'}).sort('month', ASCENDING))
+    days_of_year = list(db.stats.find({'kind': 'day_of_year'}).sort('month_day', ASCENDING))
+
+    if summary['last_beaten_date_iso'] is None:
+        days_since = None
+    else:
+        days_since = (arrow_dt.get(summary['refreshed_through_iso']).toordinal() -
+                      arrow_dt.get(summary['last_beaten_date_iso']).toordinal())
+
+    return {'summary': summary,
+            'days_since': days_since,
+            'total_days': sum(m['days'] for m in months),
+            'total_beats': sum(m['beats'] for m in months),
+            'months': months,
+            'days_of_year': days_of_year}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Refresh cached history statistics.")
+    parser.add_argument('--full', action='store_true', help="recalculate everything, not just recent months")
+    args = parser.parse_args()
+
+    refresh_stats(full=args.full)
@@ -1,14 +1,20 @@
 #!/usr/bin/env python3
 # coding: utf-8
 
+import glob
+import json
+import mimetypes
 import os
 import platform
 import time
 
 import arrow as arrow_dt
-from bottle import Bottle, run, template, static_file
+import bottle
+from bottle import Bottle, request, run, template, static_file
 from pymongo import MongoClient, DESCENDING
 
+import stats
+
 assert (platform.python_version_tuple()[0:2] == ('3', '3'))
 
 app = Bottle()
@@ -20,14 +26,83 @@ else:  # dev
 
 db = client.get_default_database()
 
+# Content-hashed, precompressed assets from build_static.py. Without a build (e.g. in dev), serve static/ as-is.
+STATIC_BUILD_ROOT = 'static/build'
+STATIC_BUILD_MANIFEST = os.path.join(STATIC_BUILD_ROOT, 'manifest.json')
+STATIC_BUILD_SOURCES = glob.glob('static/*.css') + glob.glob('views/*.tpl') + ['static/about.html']
+
+hashed_assets = set()
+if os.path.exists(STATIC_BUILD_MANIFEST):
+    # A build older than its sources would silently hide edits made since, so only use a fresh one
+    if os.path.getmtime(STATIC_BUILD_MANIFEST) >= max(os.path.getmtime(path) for path in STATIC_BUILD_SOURCES):
+        with open(STATIC_BUILD_MANIFEST) as manifest_file:
+            hashed_assets = set(json.load(manifest_file).values())
+        bottle.TEMPLATE_PATH.insert(0, './views/build/')  # Templates with references rewritten to hashed names
+    else:
+        print("Ignoring stale static build; re-run saunterio/build_static.py to use it")
+
+ONE_YEAR = 365 * 24 * 60 * 60
+
+
+def accepted_encodings():
+    """
+    Parse the request's Accept-Encoding header.
+    :return: A dict of content coding to q-value. Codings refused with q=0 are included, with a q-value of 0.
+    """
+
+    accepted = {}
+    for entry in request.headers.get('Accept-Encoding', '').split(','):
+        parts = [part.strip() for part in entry.split(';')]
+        if not parts[0]:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            if param.lower().startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        accepted[parts[0].lower()] = q
+    return accepted
+
+
+def send_precompressed(filename, cache_control):
+    """
+    Serve a file from the static build, picking the best precompressed variant the client accepts.
+    :param filename: Name of the uncompressed file in STATIC_BUILD_ROOT.
+    :param cache_control: Value for the Cache-Control header.
+    """
+
+    accepted = accepted_encodings()
+
+    for coding, suffix in [('br', '.br'), ('gzip', '.gz')]:
+        # Codings not named explicitly fall under '*', if given
+        if accepted.get(coding, accepted.get('*', 0)) > 0 and os.path.exists(os.path.join(STATIC_BUILD_ROOT, filename + suffix)):
+            # Name the type explicitly, or bottle would guess it from the .br/.gz suffix
+            response = static_file(filename + suffix, root=STATIC_BUILD_ROOT,
+                                   mimetype=mimetypes.guess_type(filename)[0])
+            response.set_header('Content-Encoding', coding)
+            break
+    else:
+        response = static_file(filename, root=STATIC_BUILD_ROOT)
+
+    response.set_header('Vary', 'Accept-Encoding')
+    response.set_header('Cache-Control', cache_control)
+    return response
+
 
 @app.route('/static/<filename>')
 def send_static(filename):
+    if filename in hashed_assets:
+        # The name changes whenever the content does, so the file can be cached forever
+        return send_precompressed(filename, 'public, max-age={}, immutable'.format(ONE_YEAR))
     return static_file(filename, root='static')
 
 
 @app.route('/about')
 def about():
+    if hashed_assets:
+        return send_precompressed('about.html', 'public, max-age=3600')
     return static_file('about.html', root='static')
 
 
@@ -70,5 +145,17 @@ def index():
     return template('weather', args)
 
 
+@app.route('/stats')
+def stats_page():
+    # Reads only the precomputed `stats` collection; the aggregations themselves run in the nightly job
+    history = stats.load_stats()
+
+    if history is None:
+        return template('stats', {'available': False})
+
+    history['available'] = True
+    return template('stats', history)
+
+
 # run(app, host='0.0.0.0', port=int(os.environ.get("PORT")), reloader=True)  # for debugging
 run(app, host='0.0.0.0', port=int(os.environ.get("PORT")))
@@ -0,0 +1,74 @@
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml">
+  <head>
+    <meta http-equiv="Content-Type" content="text/html; charset=iso-8859-1"/>
+    <meta name="viewport" content="width=device-width">
+    <meta name="viewport" content="initial-scale=0.7">
+    <title>Saunter &mdash; Weather history</title>
+    <link href="/static/style.css" rel="stylesheet" type="text/css"/>
+  </head>
+
+  <body>
+    <div id="boundingbox">
+
+      % if not available:
+      <p class="maintext">Weather history isn&rsquo;t available yet. Check back tomorrow.</p>
+
+      % else:
+      % # Scores are stored lower-is-better; display them the same way as the homepage (higher is better)
+      <p class="maintext">
+        % if days_since is None:
+        No day in Raleigh has beaten its threshold yet.
+        % else:
+        It has been {{days_since}} days since the forecast looked really good.
+        % end
+        <br/>
+        {{total_beats}} of {{total_days}} scored days have beaten their threshold.
+      </p>
+
+      <p class="maintext">
+        <b>By month</b>
+      </p>
+      <table>
+        <tr><th>Month</th><th>Scored days</th><th>Eligible days</th><th>Nice days</th></tr>
+        % for month in months:
+        <tr>
+          <td>{{month['month']}}</td>
+          <td>{{month['days']}}</td>
+          <td>{{month['eligible_days']}}</td>
+          <td>{{month['beats']}}</td>
+        </tr>
+        % end
+      </table>
+
+      <p class="maintext">
+        <b>By day of year</b>
+      </p>
+      <table>
+        <tr><th>Day</th><th>Scored</th><th>Nice</th><th>Threshold</th><th>Mean score</th><th>Best</th><th>Mean margin</th></tr>
+        % for day in days_of_year:
+        <tr>
+          <td>{{day['month_day']}}</td>
+          <td>{{day['days']}}</td>
+          <td>{{day['beats']}}</td>
+          <td>{{"{:.1f}".format(100.0 - day['mean_threshold'])}}</td>
+          % if day['eligible_days']:
+          <td>{{"{:.1f}".format(100.0 - day['mean_score'])}}</td>
+          <td>{{"{:.1f}".format(100.0 - day['best_score'])}}</td>
+          <td>{{"{:+.1f}".format(day['mean_margin'])}}</td>
+          % else:
+          <td>&ndash;</td>
+          <td>&ndash;</td>
+          <td>&ndash;</td>
+          % end
+        </tr>
+        % end
+      </table>
+      % end
+
+      <p id="analysis">
+        <a href="/">Today</a> &middot; <a href="/about">About</a><br/><br/> Updated nightly at 8:30pm ET
+      </p>
+    </div>
+  </body>
+</html>